@@ -1,87 +1,289 @@
 import asyncio
+import base64
+import hashlib
+import inspect
 import os
+import pickle
+import struct
 import sys
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
-from typing import Dict, Any, Union, Optional
-from asyncio import Queue
+from typing import Dict, Any, List, Union, Optional, Callable, Awaitable, AsyncIterator, AsyncIterable, Iterable
+import orjson
 
-# --- Add project root to sys.path ---
-# This allows importing modules from src, utils, etc.
+# --- Add project source dirs to sys.path ---
+# This allows importing modules from src (core, utils, ...) and src/rag.
+# Runs once, when this module is first imported.
 project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 src_path = os.path.join(project_root, 'src')
-if src_path not in sys.path:
-    sys.path.insert(0, src_path)
-
-# add rag to sys.path
-rag_path = os.path.join(project_root, 'src/rag')
-if rag_path not in sys.path:
-    sys.path.insert(0, rag_path)
+for path in (src_path, os.path.join(src_path, 'rag')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
 # --- Imports from your project ---
 from core.alpaca import Alpaca
 from utils.config_loader import ConfigLoader
 # from core.alpaca_interaction import AlpacaInteraction # Might be needed later
-import traceback # For error logging
-from dotenv import load_dotenv
+import logging
+from dataclasses import dataclass
+from dotenv import load_dotenv, find_dotenv
 # ---------------------------------
 
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
+
 # --- Globals ---
 # This will hold the initialized Alpaca instance
 alpaca_instance: Union[Alpaca, None] = None
 # This will hold the configuration loaded at startup
 loaded_config_data: Union[Dict[str, Any], None] = None
-# Store the username received from the client (simple global for single connection)
-current_user_name: str = "User" # Default username
+# The loaded configuration serialized once at startup, served as-is by GET /config
+loaded_config_json: Union[bytes, None] = None
+# Upper bound on pending status messages per interaction. Producers await put() when
+# the queue is full, so a slow client throttles the interaction instead of growing memory.
+interaction_queue_maxsize: int = 32
 # ----------------
 
+# --- Resolved Handlers ---
+# Looked up once after Alpaca is initialized, so the WebSocket loop does not probe
+# alpaca_instance attributes on every message. None means the component is unavailable.
+interaction_handler: Optional[Any] = None
+output_handler_interrupt: Optional[Callable[[], Any]] = None
+interaction_timeout: Optional[float] = 10
+interaction_phrase_limit: Optional[float] = 10
+interaction_duration: Optional[float] = None
+# -------------------------
+
+# --- Config Cache ---
+# The parsed configuration is pickled between restarts and reused while its sources
+# (config files, .env, the process environment and the loader module itself) are unchanged.
+# Kept under the project rather than the shared temp dir, since unpickling trusts the file.
+CONFIG_DIR = os.path.join(src_path, 'config')
+CONFIG_CACHE_PATH = os.getenv("ALPACA_CONFIG_CACHE", os.path.join(project_root, '.cache', 'alpaca_config.pkl'))
+# ---------------------
+
+# --- Text Streaming ---
+# LLM tokens are coalesced into one llm_chunk message until either bound is hit,
+# instead of sending one WebSocket frame per token.
+LLM_CHUNK_FLUSH_INTERVAL = 0.016 # seconds
+LLM_CHUNK_FLUSH_BYTES = 4096
+# ----------------------
+
+# --- Binary Audio ---
+# Clients that start with "audio_transport": "binary" get audio_chunk messages as binary
+# frames: an 8-byte header (4-byte format magic, little-endian uint32 sample rate) followed
+# by the raw PCM, instead of base64 inside JSON. Other formats still go out as JSON.
+AUDIO_FRAME_HEADER = struct.Struct("<4sI")
+AUDIO_FRAME_MAGIC = {"pcm_s16le": b"S16L", "pcm_f32le": b"F32L"}
+# --------------------
+
 app = FastAPI(
     title="Alpaca Voice Assistant API",
     description="API endpoints for controlling and interacting with the Alpaca voice assistant.",
     version="0.1.0"
 )
 
+# --- Status Queue ---
+class QueueClosed(Exception):
+    """Raised by StatusQueue.get() once the queue is closed and drained."""
+
+class StatusQueue:
+    """Bounded single-producer/single-consumer queue for interaction status messages.
+
+    Drop-in for the asyncio.Queue methods used by the interaction handler and the queue
+    reader, backed by a fixed ring buffer plus two Events instead of a deque of waiter
+    futures. Only safe with one producer and one consumer on the same event loop.
+    """
+
+    def __init__(self, maxsize: int):
+        self._buf: list = [None] * maxsize
+        self._maxsize = maxsize
+        self._head = 0 # Total items read
+        self._tail = 0 # Total items written
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._closed = False
+        self._abandoned = False # Consumer gone: puts are dropped instead of waiting for a slot
+
+    def qsize(self) -> int:
+        return self._tail - self._head
+
+    def empty(self) -> bool:
+        return self._tail == self._head
+
+    def full(self) -> bool:
+        return self._tail - self._head >= self._maxsize
+
+    def put_nowait(self, item: Any) -> None:
+        if self._abandoned:
+            return # Nobody will read it
+        if self.full():
+            raise asyncio.QueueFull
+        self._buf[self._tail % self._maxsize] = item
+        self._tail += 1
+        self._not_empty.set()
+        if self.full():
+            self._not_full.clear()
+
+    async def put(self, item: Any) -> None:
+        """Waits for a free slot, so a slow consumer throttles the producer."""
+        while self.full() and not self._abandoned:
+            await self._not_full.wait()
+        self.put_nowait(item)
+
+    def get_nowait(self) -> Any:
+        if self.empty():
+            raise asyncio.QueueEmpty
+        index = self._head % self._maxsize
+        item = self._buf[index]
+        self._buf[index] = None # Drop the reference so the message can be freed
+        self._head += 1
+        self._not_full.set()
+        if self.empty():
+            self._not_empty.clear()
+        return item
+
+    async def get(self) -> Any:
+        while self.empty():
+            if self._closed:
+                raise QueueClosed
+            await self._not_empty.wait()
+        return self.get_nowait()
+
+    def close(self) -> None:
+        """Marks the end of the stream; get() raises QueueClosed once the remaining items are read."""
+        self._closed = True
+        self._not_empty.set() # Wake the consumer if it is waiting
+
+    def abandon(self) -> None:
+        """Marks the consumer as gone; pending and later puts return at once, dropping the item.
+
+        Keeps a producer that is still running (e.g. reporting its own cancellation) from
+        blocking forever on a full queue nobody drains.
+        """
+        self._abandoned = True
+        self._buf = [None] * self._maxsize # Free anything left unread
+        self._not_full.set() # Wake the producer if it is waiting
+
+    def task_done(self) -> None:
+        """No-op; kept for asyncio.Queue compatibility (join() is not supported)."""
+# ---------------------
+
 # --- State Variables ---
-# For simplicity, we manage task state globally for a single connection.
-# In a multi-user scenario, this state would need to be managed per WebSocket connection.
-current_interaction_task: Optional[asyncio.Task] = None
-queue_reader_task: Optional[asyncio.Task] = None
-interaction_queue: Optional[Queue] = None
+@dataclass(eq=False) # Identity hashing, so states can be tracked in a set
+class ConnectionState:
+    """Per-connection interaction state, owned by a single websocket_endpoint call."""
+    client_address: str = ""
+    user_name: str = "User" # Default username, updated by the client
+    binary_audio: bool = False # Send audio_chunk messages as binary frames (set by "start")
+    voice_session: Optional[asyncio.Task] = None # Task running run_voice_session()
+    stop_event: Optional[asyncio.Event] = None # Set to stop the current voice session
+
+    def voice_active(self) -> bool:
+        return self.voice_session is not None and not self.voice_session.done()
+
+    def cancel_tasks(self) -> None:
+        """Cancels the voice session (its task group cancels the interaction and reader)."""
+        if self.voice_active():
+            logger.info("[%s] Cancelling voice session.", self.client_address)
+            self.voice_session.cancel()
+        self.voice_session = None
+        self.stop_event = None
+
+# Live connections, so shutdown can cancel their tasks. Each connection owns its state,
+# so concurrent clients no longer cancel each other's interactions.
+active_connections: set = set()
 # ---------------------
 
+def config_signature() -> Optional[str]:
+    """Hashes everything the loaded config depends on. Returns None if no config files are found.
+
+    ConfigLoader also reads environment variables, which can be set outside .env (shell,
+    docker, systemd), so the whole process environment is part of the key. Any change to it
+    just costs a reload; a narrower key could silently serve a stale config.
+    """
+    paths = []
+    for root, _, names in os.walk(CONFIG_DIR):
+        paths.extend(os.path.join(root, name) for name in names)
+    if not paths:
+        return None # Nothing to key the cache on
+    dotenv_path = find_dotenv()
+    if dotenv_path:
+        paths.append(dotenv_path)
+    paths.append(inspect.getfile(ConfigLoader))
+    digest = hashlib.sha1()
+    for path in sorted(paths):
+        digest.update(path.encode())
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    for name, value in sorted(os.environ.items()):
+        digest.update(f"{name}={value}\0".encode(errors="surrogateescape"))
+    return digest.hexdigest()
+
+def load_config_cached() -> Optional[Dict[str, Any]]:
+    """Returns the cached config if its sources are unchanged, otherwise loads and caches it."""
+    signature = config_signature()
+    if signature and os.path.exists(CONFIG_CACHE_PATH):
+        try:
+            with open(CONFIG_CACHE_PATH, 'rb') as f:
+                cached_signature, cached_config = pickle.load(f)
+            if cached_signature == signature:
+                logger.info("Configurations loaded from cache (%s).", CONFIG_CACHE_PATH)
+                return cached_config
+        except Exception as e:
+            logger.warning("Ignoring unreadable config cache: %s", e)
+
+    config_loader = ConfigLoader()
+    # Pass specific paths if necessary, otherwise uses defaults / env vars
+    assistant_params = config_loader.load_all()
+    if signature and assistant_params:
+        try:
+            os.makedirs(os.path.dirname(CONFIG_CACHE_PATH), exist_ok=True)
+            tmp_path = f"{CONFIG_CACHE_PATH}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump((signature, assistant_params), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, CONFIG_CACHE_PATH) # Atomic, so a crash never leaves a torn cache
+        except Exception as e:
+            logger.warning("Could not write config cache: %s", e)
+    return assistant_params
+
 @app.on_event("startup")
 async def startup_event():
     """Loads configuration and initializes the Alpaca instance on server start."""
-    global alpaca_instance, loaded_config_data
-    print("API Server starting up...")
+    global alpaca_instance, loaded_config_data, loaded_config_json, interaction_queue_maxsize
+    global interaction_handler, output_handler_interrupt, interaction_timeout, interaction_phrase_limit, interaction_duration
+    logger.info("API Server starting up...")
     load_dotenv() # Load .env file for configurations
 
+    # --- WebSocket Queue Bound (tunable via INTERACTION_QUEUE_MAXSIZE) ---
+    try:
+        interaction_queue_maxsize = max(1, int(os.getenv("INTERACTION_QUEUE_MAXSIZE", interaction_queue_maxsize)))
+    except ValueError:
+        logger.warning("Invalid INTERACTION_QUEUE_MAXSIZE, using default of %s.", interaction_queue_maxsize)
+    logger.info("Interaction queue bound: %s messages.", interaction_queue_maxsize)
+
     # --- RAG Indexing (Optional but recommended, similar to main.py) ---
     # You might want to run indexing here if the API needs up-to-date RAG data at startup
     # try:
-    #     print("--- Running RAG Indexing --- ")
+    #     logger.info("Running RAG indexing...")
     #     from rag.indexer import run_indexing # Import locally if run here
     #     await run_indexing()
-    #     print("--- RAG Indexing Complete --- \n")
+    #     logger.info("RAG indexing complete.")
     # except Exception as e:
-    #     print(f"***** WARNING: ERROR DURING RAG INDEXING *****: {e}")
-    #     print("***** RAG features may be unavailable or outdated. *****")
-    #     traceback.print_exc()
+    #     logger.exception("Error during RAG indexing; RAG features may be unavailable or outdated: %s", e)
     # -------------------------------------------------------------------
 
     # --- Load Configuration ---
     try:
-        config_loader = ConfigLoader()
-        # Pass specific paths if necessary, otherwise uses defaults / env vars
-        assistant_params = config_loader.load_all()
+        assistant_params = load_config_cached()
         if not assistant_params:
-            print("FATAL: Failed to load configurations for API server. Check config files and .env")
+            logger.critical("Failed to load configurations for API server. Check config files and .env")
             return
         loaded_config_data = assistant_params # Store loaded config globally
-        print("Configurations loaded.")
+        logger.info("Configurations loaded.")
     except Exception as e:
-        print(f"FATAL: Error loading configurations: {e}")
-        traceback.print_exc()
+        logger.critical("Error loading configurations: %s", e, exc_info=True)
         return # Prevent startup if config fails
     # -------------------------
 
@@ -93,62 +295,85 @@ async def startup_event():
         # We might need to adjust Alpaca.__init__ if 'api' mode needs specific handling.
         # For now, assume it loads necessary components based on config.
         # --- CORRECTION: Need 'voice' mode to load audio components for voice interactions --- 
-        print("Initializing Alpaca instance (mode='voice')...")
+        logger.info("Initializing Alpaca instance (mode='voice')...")
         alpaca_instance = Alpaca(**loaded_config_data, mode='voice') # Use 'voice' mode
-        print("Alpaca instance initialized successfully for API.")
+        logger.info("Alpaca instance initialized successfully for API.")
     except Exception as e:
-        print(f"FATAL: Error initializing Alpaca instance: {e}")
-        traceback.print_exc()
+        logger.critical("Error initializing Alpaca instance: %s", e, exc_info=True)
         alpaca_instance = None # Ensure instance is None if init fails
         # Prevent startup or run in a degraded state? For now, allow startup but endpoints will fail.
     # ------------------------
-    print("API Server startup complete.")
+
+    # --- Serialize Config for GET /config ---
+    # Config is immutable after startup, so serialize it once. Kept out of the config-loading
+    # try above: a value orjson cannot encode only disables /config (503), not the server.
+    try:
+        # Non-str keys (e.g. numeric YAML keys) are stringified, as stdlib json would
+        loaded_config_json = orjson.dumps(loaded_config_data, option=orjson.OPT_NON_STR_KEYS)
+    except TypeError as e: # orjson.JSONEncodeError is a TypeError subclass
+        logger.error("Could not serialize configuration for /config; it will return 503: %s", e)
+        loaded_config_json = None
+    # ----------------------------------------
+
+    # --- Resolve Handlers ---
+    if alpaca_instance:
+        interaction_handler = getattr(alpaca_instance, 'interaction_handler', None)
+        interrupt = getattr(getattr(alpaca_instance, 'output_handler', None), 'interrupt', None)
+        output_handler_interrupt = interrupt if callable(interrupt) else None
+        # Interaction parameters (optional, use defaults or pass via WS)
+        interaction_timeout = getattr(alpaca_instance, 'timeout_arg', 10)
+        interaction_phrase_limit = getattr(alpaca_instance, 'phrase_limit_arg', 10)
+        interaction_duration = getattr(alpaca_instance, 'duration_arg', None)
+        if interaction_handler is None:
+            logger.warning("Alpaca instance has no interaction_handler; interactions will be unavailable.")
+        if output_handler_interrupt is None:
+            logger.warning("Output handler has no interrupt() method; TTS interrupts will be unavailable.")
+    # ------------------------
+    logger.info("API Server startup complete.")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleans up resources on server shutdown."""
-    global alpaca_instance, loaded_config_data, current_interaction_task, queue_reader_task
-    print("API Server shutting down...")
+    global alpaca_instance, loaded_config_data, loaded_config_json
+    global interaction_handler, output_handler_interrupt
+    logger.info("API Server shutting down...")
     # --- Cancel any running tasks ---
-    if current_interaction_task and not current_interaction_task.done():
-        print("Cancelling active interaction task...")
-        current_interaction_task.cancel()
-    if queue_reader_task and not queue_reader_task.done():
-        print("Cancelling queue reader task...")
-        queue_reader_task.cancel()
+    for state in list(active_connections):
+        state.cancel_tasks()
+    active_connections.clear()
     # -----------------------------
     # --- Cleanup Alpaca Components ---
     if alpaca_instance and hasattr(alpaca_instance, 'component_manager'):
-        print("Cleaning up Alpaca components...")
+        logger.info("Cleaning up Alpaca components...")
         try:
             # Assuming component_manager.cleanup() handles stopping threads/processes etc.
             # If cleanup needs to be async, adjust Alpaca/ComponentManager accordingly.
             # For now, assuming it's synchronous or handles async internally.
             alpaca_instance.component_manager.cleanup()
-            print("Alpaca components cleaned up.")
+            logger.info("Alpaca components cleaned up.")
         except Exception as e:
-            print(f"Error during Alpaca component cleanup: {e}")
-            traceback.print_exc()
+            logger.exception("Error during Alpaca component cleanup: %s", e)
     elif alpaca_instance:
-        print("Alpaca instance exists but has no component_manager attribute for cleanup.")
+        logger.info("Alpaca instance exists but has no component_manager attribute for cleanup.")
     else:
-        print("No Alpaca instance to clean up.")
+        logger.info("No Alpaca instance to clean up.")
     # --------------------------------
     # Clear global state
     alpaca_instance = None
     loaded_config_data = None
-    current_interaction_task = None
-    queue_reader_task = None
-    print("API Server shutdown complete.")
+    loaded_config_json = None
+    interaction_handler = None
+    output_handler_interrupt = None
+    logger.info("API Server shutdown complete.")
 
 
 @app.get("/config", response_model=Dict[str, Any])
 async def get_config():
     """Returns the current configuration loaded by the Alpaca assistant at startup."""
-    global loaded_config_data
-    if loaded_config_data:
-        # Return a copy to prevent accidental modification if needed, though FastAPI handles serialization
-        return JSONResponse(content=loaded_config_data.copy())
+    global loaded_config_json
+    if loaded_config_json:
+        # Pre-serialized at startup; no per-request copy or re-encoding
+        return Response(content=loaded_config_json, media_type="application/json")
     else:
         # Return 503 Service Unavailable if config wasn't loaded during startup
         return JSONResponse(
@@ -157,354 +382,512 @@ async def get_config():
         )
 
 # --- WebSocket Helper ---
-async def handle_interaction_queue(websocket: WebSocket, queue: Queue):
-    """Reads messages from the interaction queue and sends them to the client."""
+def encode_message(message: Dict[str, Any]) -> str:
+    """Serializes an outbound message with orjson for a WebSocket text frame."""
+    # Text frames (not binary) so browser clients can keep using JSON.parse(event.data).
+    return orjson.dumps(message).decode()
+
+async def send_message(websocket: WebSocket, message: Dict[str, Any]) -> None:
+    """Sends a JSON message to the client, encoded with orjson instead of stdlib json."""
+    await websocket.send_text(encode_message(message))
+
+# llm_chunk is the most frequent message; only the text needs encoding, the envelope is fixed.
+LLM_CHUNK_PREFIX = '{"type":"llm_chunk","text":'
+
+def encode_llm_chunk(text: str) -> str:
+    """Same output as encode_message({"type": "llm_chunk", "text": text}), without the dict."""
+    return LLM_CHUNK_PREFIX + orjson.dumps(text).decode() + "}"
+
+# Static messages, encoded once at import time and sent with websocket.send_text().
+# Sent as soon as a connection is accepted, so clients know the server state without asking.
+HELLO_MESSAGE = encode_message({"type": "status", "state": "Idle", "capabilities": ["voice", "text", "interrupt"]})
+INFO_INTERRUPT_SENT = encode_message({"type": "info", "message": "Interrupt signal sent to TTS handler."})
+INFO_INTERRUPT_UNAVAILABLE = encode_message({"type": "info", "message": "Interrupt received, but TTS handler could not be signalled."})
+ERR_NOT_INITIALIZED = encode_message({"type": "error", "message": "Alpaca assistant not initialized.", "state": "Error"})
+ERR_NOT_INITIALIZED_ON_CONNECT = encode_message({"type": "error", "message": "Alpaca assistant not initialized on server.", "state": "Error"})
+ERR_IMPROPERLY_CONFIGURED = encode_message({"type": "error", "message": "Alpaca assistant improperly configured on server.", "state": "Error"})
+ERR_NO_INTERACTION_HANDLER = encode_message({"type": "error", "message": "Server configuration error: Alpaca instance lacks an 'interaction_handler'", "state": "Error"})
+ERR_NOT_AN_OBJECT = encode_message({"type": "error", "message": "Expected a JSON object message."})
+ERR_BUSY = encode_message({"type": "error", "message": "An interaction is already in progress.", "state": "Busy"})
+ERR_VOICE_ACTIVE = encode_message({"type": "error", "message": "Cannot send text while voice interaction is active.", "state": "Busy"})
+ERR_EMPTY_TEXT = encode_message({"type": "error", "message": "Received empty text for 'send_text' action.", "state": "Idle"})
+INFO_USE_SEND_TEXT = encode_message({"type": "info", "message": "Use 'send_text' action for text interactions."})
+INFO_STOP_PROCESSED = encode_message({"type": "info", "message": "Stop command processed. Interaction cancelled."})
+STATUS_NOTHING_TO_STOP = encode_message({"type": "status", "state": "Idle", "message": "Stop command received, nothing active to stop."})
+STATUS_PROCESSING = encode_message({"type": "status", "state": "Processing"})
+STATUS_IDLE = encode_message({"type": "status", "state": "Idle"})
+
+def encode_audio_frame(message: Dict[str, Any]) -> Optional[bytes]:
+    """Packs an audio_chunk message into a binary frame, or None if its format has no magic."""
+    magic = AUDIO_FRAME_MAGIC.get(str(message.get("format", "pcm_s16le")).lower())
+    if magic is None:
+        return None
+    pcm = message.get("data") or b""
+    if isinstance(pcm, str):
+        pcm = base64.b64decode(pcm)
+    return AUDIO_FRAME_HEADER.pack(magic, int(message.get("sample_rate") or 16000)) + pcm
+
+async def send_json_messages(websocket: WebSocket, messages: List[Dict[str, Any]]) -> None:
+    """Sends one message as-is, or several as a single batch frame."""
+    if len(messages) == 1:
+        await send_message(websocket, messages[0])
+    elif messages:
+        await send_message(websocket, {"type": "batch", "items": messages})
+
+async def handle_interaction_queue(websocket: WebSocket, queue: StatusQueue, binary_audio: bool = False):
+    """Reads messages from the interaction queue and sends them to the client.
+
+    Everything already queued when the reader wakes up is sent as one frame: a single
+    message as-is, several as {"type": "batch", "items": [...]}. A status update that
+    repeats the previous message's state is dropped. With binary_audio, audio chunks are
+    sent as their own binary frames, in order with the JSON frames around them.
+    """
     try:
-        while True:
-            message = await queue.get()
-            await websocket.send_json(message)
+        final_state = None
+        last_key = None
+        while final_state is None:
+            batch = [await queue.get()]
+            while True:
+                try:
+                    batch.append(queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            # If a message indicates the end of interaction (e.g., Error, Cancelled, Disabled),
+            # send up to and including it, then stop reading
+            for i, message in enumerate(batch):
+                if message.get("type") == "status" and message.get("state") in ["Error", "Cancelled", "Disabled"]:
+                    final_state = message.get("state")
+                    del batch[i + 1:]
+                    break
+            # Skip repeated statuses (e.g. "Listening" re-sent during a long plateau)
+            forwarded = []
+            for message in batch:
+                key = (message.get("type"), message.get("state"))
+                if key[0] == "status" and key == last_key:
+                    continue
+                last_key = key
+                forwarded.append(message)
+            if binary_audio:
+                pending = []
+                for message in forwarded:
+                    frame = encode_audio_frame(message) if message.get("type") == "audio_chunk" else None
+                    if frame is None:
+                        pending.append(message)
+                        continue
+                    await send_json_messages(websocket, pending)
+                    pending = []
+                    await websocket.send_bytes(frame)
+                forwarded = pending
+            await send_json_messages(websocket, forwarded)
             queue.task_done()
-            # If the message indicates the end of interaction (e.g., Idle, Error, Interrupted, Cancelled, Disabled), stop reading
-            if message.get("type") == "status" and message.get("state") in ["Error", "Cancelled", "Disabled"]:
-                 print(f"[QueueReader] Received final state '{message.get('state')}'. Exiting.")
-                 break
+        logger.info("[QueueReader] Received final state '%s'. Exiting.", final_state)
+    except QueueClosed:
+        logger.info("[QueueReader] Interaction finished and queue drained. Exiting.")
     except asyncio.CancelledError:
-        print("[QueueReader] Task cancelled.")
+        logger.info("[QueueReader] Task cancelled.")
+        raise # Let the session's task group see the cancellation
     except WebSocketDisconnect:
-        print("[QueueReader] WebSocket disconnected.")
+        logger.info("[QueueReader] WebSocket disconnected.")
     except Exception as e:
-        print(f"[QueueReader] Error: {e}")
-        traceback.print_exc()
+        logger.exception("[QueueReader] Error: %s", e)
         # Try to send error to client if possible
         try:
-            await websocket.send_json({"type": "error", "message": f"Queue reader error: {e}", "state": "Error"})
+            await send_message(websocket, {"type": "error", "message": f"Queue reader error: {e}", "state": "Error"})
         except:
             pass # Ignore if sending fails
     finally:
-        print("[QueueReader] Exiting task.")
+        logger.info("[QueueReader] Exiting task.")
+
+async def iterate_chunks(response: Union[Iterable[str], AsyncIterable[str]]) -> AsyncIterator[str]:
+    """Yields LLM response chunks without blocking the event loop.
+
+    Async generators are iterated directly. A plain generator may block on LLM I/O between
+    chunks, so it is advanced one chunk at a time in the default executor.
+    """
+    if isinstance(response, AsyncIterable):
+        async for chunk in response:
+            yield chunk
+        return
+    loop = asyncio.get_running_loop()
+    iterator = iter(response)
+    exhausted = object()
+    while True:
+        chunk = await loop.run_in_executor(None, next, iterator, exhausted)
+        if chunk is exhausted:
+            return
+        yield chunk
+
+async def stream_llm_chunks(websocket: WebSocket, chunks: AsyncIterator[str]) -> str:
+    """Sends chunks as coalesced llm_chunk messages and returns the full response text.
+
+    Buffered text is flushed once LLM_CHUNK_FLUSH_BYTES accumulate or LLM_CHUNK_FLUSH_INTERVAL
+    has passed since the last flush, even if the next chunk has not arrived yet.
+    """
+    loop = asyncio.get_running_loop()
+    response_parts = []
+    buf = []
+    buf_bytes = 0
+    last_flush = loop.time()
+    next_chunk = asyncio.ensure_future(anext(chunks))
+    try:
+        while True:
+            # While text is buffered, wait for the next chunk only until the flush deadline
+            timeout = max(0.0, last_flush + LLM_CHUNK_FLUSH_INTERVAL - loop.time()) if buf else None
+            done, _ = await asyncio.wait((next_chunk,), timeout=timeout)
+            if done:
+                try:
+                    chunk = next_chunk.result()
+                except StopAsyncIteration:
+                    break
+                next_chunk = asyncio.ensure_future(anext(chunks))
+                if chunk:
+                    response_parts.append(chunk)
+                    buf.append(chunk)
+                    buf_bytes += len(chunk)
+            if buf and (buf_bytes >= LLM_CHUNK_FLUSH_BYTES or loop.time() - last_flush >= LLM_CHUNK_FLUSH_INTERVAL):
+                await websocket.send_text(encode_llm_chunk("".join(buf)))
+                buf.clear()
+                buf_bytes = 0
+                last_flush = loop.time()
+    finally:
+        next_chunk.cancel() # No-op once finished; stops a pending read if sending failed
+    if buf: # Flush whatever is left before reporting Idle
+        await websocket.send_text(encode_llm_chunk("".join(buf)))
+    return "".join(response_parts)
+
+async def run_voice_session(websocket: WebSocket, state: ConnectionState, stop_event: asyncio.Event) -> None:
+    """Runs one voice interaction and its queue reader in a task group.
+
+    Setting stop_event cancels the interaction; the reader still sends whatever was queued
+    and then exits. If the reader exits first (final state, disconnect), the interaction is
+    cancelled. Cancelling this task (e.g. on disconnect) cancels both. If either task fails,
+    the task group cancels the other and the error is reported to the client.
+    """
+    # Bounded so the interaction handler's `await status_queue.put(...)` blocks
+    # while the client drains, rather than buffering without limit.
+    queue = StatusQueue(maxsize=interaction_queue_maxsize)
+    try:
+        async with asyncio.TaskGroup() as tg:
+            # Start the task to read from the queue and send to websocket
+            reader = tg.create_task(handle_interaction_queue(websocket, queue, state.binary_audio), name=f"QueueReader_{state.client_address}")
+
+            logger.info("Starting voice interaction task (timeout=%s, phrase_limit=%s, duration=%s)...", interaction_timeout, interaction_phrase_limit, interaction_duration)
+            # Start the actual interaction task, passing the queue and current username
+            interaction = tg.create_task(
+                interaction_handler.run_voice_interaction_loop(
+                    status_queue=queue,
+                    duration=interaction_duration,
+                    timeout=interaction_timeout,
+                    phrase_limit=interaction_phrase_limit,
+                    user_name=state.user_name # Pass current name
+                ),
+                name=f"VoiceInteractionLoop_{state.client_address}"
+            )
+            # However the interaction ends (finished, cancelled or failed), close its queue so
+            # the reader sends what is left and exits instead of waiting on it forever.
+            interaction.add_done_callback(lambda _: queue.close())
+            # Conversely, once the reader stops (final state, disconnect or error) nobody drains
+            # the bounded queue: drop further puts (including the status the interaction sends
+            # when cancelled) so it cannot block forever in put(), then cancel it.
+            def on_reader_done(_: asyncio.Task) -> None:
+                queue.abandon()
+                interaction.cancel()
+            reader.add_done_callback(on_reader_done)
+
+            stop_wait = asyncio.ensure_future(stop_event.wait())
+            try:
+                await asyncio.wait((interaction, stop_wait), return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                stop_wait.cancel()
+            if stop_event.is_set():
+                logger.debug("Cancelling interaction task due to 'stop' command.")
+                interaction.cancel()
+    except* WebSocketDisconnect:
+        logger.info("[%s] WebSocket disconnected during voice session.", state.client_address)
+    except* Exception as eg:
+        logger.error("Voice interaction failed", exc_info=eg.exceptions[0])
+        # The socket may be gone too; nothing awaits this task, so don't let the send raise
+        try:
+            await send_message(websocket, {"type": "error", "message": f"Voice interaction error: {eg.exceptions[0]}", "state": "Error"})
+        except WebSocketDisconnect:
+            logger.info("[%s] Client disconnected before voice error could be sent.", state.client_address)
+        except Exception as send_e:
+            logger.error("[%s] Error sending voice error message: %s", state.client_address, send_e)
 
 # --- End WebSocket Helper ---
 
+# --- WebSocket Action Handlers ---
+# Each handler takes the socket, the parsed client message and the connection state.
+async def handle_start(websocket: WebSocket, data: Dict[str, Any], state: ConnectionState) -> None:
+    """Starts a voice interaction whose status updates are streamed through the queue."""
+    mode = data.get("mode", "voice")
+    logger.debug("Received 'start' action, mode: %s", mode)
+
+    if state.voice_active():
+         await websocket.send_text(ERR_BUSY)
+         return
+
+    if mode == "voice":
+        # --- Start Voice Interaction ---
+        if interaction_handler is None:
+            await websocket.send_text(ERR_NO_INTERACTION_HANDLER)
+            return
+        state.binary_audio = data.get("audio_transport") == "binary"
+        # The session owns the interaction and reader tasks; they are cancelled together
+        state.stop_event = asyncio.Event()
+        state.voice_session = asyncio.create_task(
+            run_voice_session(websocket, state, state.stop_event),
+            name=f"VoiceSession_{state.client_address}"
+        )
+        # --- End Start Voice Interaction ---
+
+    elif mode == "text":
+         # This assumes text interaction is short and doesn't need complex task management
+         # Re-using existing text logic here
+         await websocket.send_text(INFO_USE_SEND_TEXT)
+         # If you want start to trigger a text loop, implement similar task logic as voice
+    else:
+         await send_message(websocket, {"type": "error", "message": f"Unsupported start mode: {mode}", "state": "Error"})
+
+async def handle_stop(websocket: WebSocket, data: Dict[str, Any], state: ConnectionState) -> None:
+    """Cancels the active voice interaction, if any."""
+    logger.debug("Received 'stop' action")
+    interrupted_by_client = False
+    if state.voice_active():
+        # The session cancels the interaction; its queue reader then sends what is
+        # left on the queue and exits, which ends the session.
+        state.stop_event.set()
+        interrupted_by_client = True
+    else:
+         logger.debug("No active interaction task to stop.")
+
+    # Send status based on whether we cancelled something
+    if interrupted_by_client:
+        # The interaction task will put 'Cancelled' or 'Interrupted' on the queue,
+        # which handle_interaction_queue will send.
+        # Sending an immediate status might be redundant or confusing.
+        # Let's just confirm the stop was processed.
+        await websocket.send_text(INFO_STOP_PROCESSED)
+        # Optional: Send Idle state if confident cancellation worked immediately
+        # await send_message(websocket, {"type": "status", "state": "Idle", "message": "Stopped by client."}) 
+    else:
+         await websocket.send_text(STATUS_NOTHING_TO_STOP)
+
+async def handle_send_text(websocket: WebSocket, data: Dict[str, Any], state: ConnectionState) -> None:
+    """Runs a single text interaction and streams the response back as llm_chunk messages."""
+    text = data.get("text")
+    if not text:
+        await websocket.send_text(ERR_EMPTY_TEXT)
+        return
+
+    logger.debug("Received 'send_text': '%.50s...' (User: %s)", text, state.user_name)
+    
+    if state.voice_active():
+        await websocket.send_text(ERR_VOICE_ACTIVE)
+        return
+
+    if interaction_handler is None:
+        await websocket.send_text(ERR_NO_INTERACTION_HANDLER)
+        return
+
+    await websocket.send_text(STATUS_PROCESSING)
+    try:
+        # Pass current username to the text interaction handler
+        response = interaction_handler.run_single_text_interaction(
+            user_text=text, 
+            user_name=state.user_name
+        )
+        if inspect.isawaitable(response): # Coroutine returning a generator rather than an async generator
+            response = await response
+        full_response = await stream_llm_chunks(websocket, iterate_chunks(response))
+        await send_message(websocket, {"type": "status", "state": "Idle", "final_response": full_response})
+        logger.info("Text interaction streaming complete.")
+    except AttributeError as ae:
+         logger.exception("Error accessing interaction handler: %s", ae)
+         await send_message(websocket, {"type": "error", "message": f"Server configuration error: {ae}", "state": "Error"})
+    except Exception as e:
+        logger.exception("Error during text interaction: %s", e)
+        await send_message(websocket, {"type": "error", "message": f"Error processing text: {e}", "state": "Error"})
+        await websocket.send_text(STATUS_IDLE)
+
+async def handle_interrupt(websocket: WebSocket, data: Dict[str, Any], state: ConnectionState) -> None:
+    """Signals the output handler to stop TTS playback."""
+    logger.debug("Received 'interrupt' action")
+    interrupted_tts = False
+    # Resolved at startup; None if the output handler cannot be interrupted
+    if output_handler_interrupt is not None:
+        try:
+            logger.debug("Calling output_handler.interrupt()...")
+            output_handler_interrupt()
+            interrupted_tts = True
+        except Exception as e:
+            logger.error("Error calling output_handler.interrupt(): %s", e)
+    else:
+        logger.warning("Cannot interrupt TTS, Output handler or its interrupt() method missing.")
+
+    # Send confirmation back to client
+    if interrupted_tts:
+        # The actual status change (Interrupted, Idle) will come via the queue later
+        await websocket.send_text(INFO_INTERRUPT_SENT)
+    else:
+        await websocket.send_text(INFO_INTERRUPT_UNAVAILABLE)
+
+async def handle_toggle_vad_interrupt(websocket: WebSocket, data: Dict[str, Any], state: ConnectionState) -> None:
+    """Acknowledges a VAD interrupt toggle (server-side logic not implemented yet)."""
+    # TODO: Implement actual VAD toggle logic
+    # This requires state management and potentially modifying OutputHandler/AudioHandler
+    enabled = data.get("enabled", False)
+    logger.debug("Received 'toggle_vad_interrupt', enabled: %s (Logic not fully implemented)", enabled)
+    # Example: Store state per connection if managing multiple clients
+    # state.vad_enabled = enabled
+    await send_message(websocket, {"type": "info", "message": f"VAD Interrupt Toggled: {enabled} (Server logic TBD)"})
+
+async def handle_unknown_action(websocket: WebSocket, data: Dict[str, Any], state: ConnectionState) -> None:
+    """Replies with an error for actions that have no handler."""
+    action = data.get("action")
+    logger.warning("Unknown action received: %s", action)
+    await send_message(websocket, {"type": "error", "message": f"Unknown action: {action}"})
+
+# Maps the client's "action" field to its handler; one dict lookup per message.
+ACTION_HANDLERS: Dict[str, Callable[[WebSocket, Dict[str, Any], ConnectionState], Awaitable[None]]] = {
+    "start": handle_start,
+    "stop": handle_stop,
+    "send_text": handle_send_text,
+    "interrupt": handle_interrupt,
+    "toggle_vad_interrupt": handle_toggle_vad_interrupt,
+}
+# --- End WebSocket Action Handlers ---
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     """Handles the main WebSocket connection for real-time interaction."""
-    global alpaca_instance, current_interaction_task, queue_reader_task, interaction_queue, current_user_name
-
     client_address = f"{websocket.client.host}:{websocket.client.port}"
-    print(f"WebSocket connection established from {client_address}")
-
-    # --- Simple single-client handling ---
-    # If an interaction is somehow active from a previous connection, try to cancel it.
-    if current_interaction_task and not current_interaction_task.done():
-        print(f"Warning: Cancelling remnant interaction task from previous connection.")
-        current_interaction_task.cancel()
-    if queue_reader_task and not queue_reader_task.done():
-        print(f"Warning: Cancelling remnant queue reader task from previous connection.")
-        queue_reader_task.cancel()
-    current_interaction_task = None
-    queue_reader_task = None
-    interaction_queue = None # Reset queue on new connection
-    # -------------------------------------
+    logger.info("WebSocket connection established from %s", client_address)
+    state = ConnectionState(client_address=client_address)
 
     await websocket.accept()
+    try:
+        await websocket.send_text(HELLO_MESSAGE)
+    except WebSocketDisconnect:
+        logger.info("[%s] Client disconnected before hello could be sent.", client_address)
+        return
 
     # --- Generate and Send Initial Greeting ---
-    if alpaca_instance and hasattr(alpaca_instance, 'interaction_handler'):
+    if alpaca_instance and interaction_handler is not None:
         try:
-            print(f"[{client_address}] Generating initial greeting...")
+            logger.info("[%s] Generating initial greeting...", client_address)
             # Pass the *default* username for the initial greeting
-            initial_greeting = await alpaca_instance.interaction_handler.generate_initial_greeting(user_name=current_user_name)
+            initial_greeting = await interaction_handler.generate_initial_greeting(user_name=state.user_name)
             
             # Try sending the greeting, catching disconnect specifically
             try:
-                await websocket.send_json({"type": "llm_chunk", "text": initial_greeting})
-                print(f"[{client_address}] Initial greeting sent.")
+                await websocket.send_text(encode_llm_chunk(initial_greeting))
+                logger.info("[%s] Initial greeting sent.", client_address)
             except WebSocketDisconnect:
-                print(f"[{client_address}] Client disconnected before initial greeting could be sent.")
+                logger.info("[%s] Client disconnected before initial greeting could be sent.", client_address)
                 return # Exit endpoint cleanly for this connection
             except Exception as send_e:
-                print(f"[{client_address}] Error sending initial greeting message (but not disconnect): {send_e}")
+                logger.error("[%s] Error sending initial greeting message (but not disconnect): %s", client_address, send_e)
                 # Optionally send error or close, but handle potential disconnect here too
                 try:
-                     await websocket.send_json({"type": "error", "message": f"Failed to send initial greeting: {send_e}", "state": "Error"})
+                     await send_message(websocket, {"type": "error", "message": f"Failed to send initial greeting: {send_e}", "state": "Error"})
                 except WebSocketDisconnect:
-                     print(f"[{client_address}] Client disconnected before greeting send error could be sent.")
+                     logger.info("[%s] Client disconnected before greeting send error could be sent.", client_address)
                 return # Exit endpoint
 
         except WebSocketDisconnect:
              # This might catch disconnects during the greeting *generation* if it involves yielding
-             print(f"[{client_address}] Client disconnected during initial greeting generation.")
+             logger.info("[%s] Client disconnected during initial greeting generation.", client_address)
              return # Exit endpoint cleanly
         except Exception as e: # Catch errors during greeting *generation*
-            print(f"[{client_address}] Error generating initial greeting: {e}")
-            traceback.print_exc()
+            logger.exception("[%s] Error generating initial greeting: %s", client_address, e)
             # Send error to client if greeting generation fails, handling potential disconnect
             try:
-                 await websocket.send_json({"type": "error", "message": f"Failed to generate initial greeting: {e}", "state": "Error"})
+                 await send_message(websocket, {"type": "error", "message": f"Failed to generate initial greeting: {e}", "state": "Error"})
             except WebSocketDisconnect:
-                 print(f"[{client_address}] Client disconnected before greeting generation error could be sent.")
+                 logger.info("[%s] Client disconnected before greeting generation error could be sent.", client_address)
             except Exception as send_e:
-                 print(f"[{client_address}] Error sending greeting generation error message: {send_e}")
+                 logger.error("[%s] Error sending greeting generation error message: %s", client_address, send_e)
             return # Exit endpoint after generation error
             
     elif not alpaca_instance:
-        print(f"[{client_address}] Cannot send greeting: Alpaca instance not available.")
+        logger.error("[%s] Cannot send greeting: Alpaca instance not available.", client_address)
         try:
-            await websocket.send_json({"type": "error", "message": "Alpaca assistant not initialized on server.", "state": "Error"})
+            await websocket.send_text(ERR_NOT_INITIALIZED_ON_CONNECT)
             await websocket.close(code=1011)
         except WebSocketDisconnect:
-             print(f"[{client_address}] Client disconnected before Alpaca init error could be sent.")
+             logger.info("[%s] Client disconnected before Alpaca init error could be sent.", client_address)
         return
     else: # alpaca_instance exists but no interaction_handler?
-        print(f"[{client_address}] Cannot send greeting: Alpaca interaction handler not found.")
+        logger.error("[%s] Cannot send greeting: Alpaca interaction handler not found.", client_address)
         try:
-            await websocket.send_json({"type": "error", "message": "Alpaca assistant improperly configured on server.", "state": "Error"})
+            await websocket.send_text(ERR_IMPROPERLY_CONFIGURED)
             await websocket.close(code=1011)
         except WebSocketDisconnect:
-             print(f"[{client_address}] Client disconnected before Alpaca config error could be sent.")
+             logger.info("[%s] Client disconnected before Alpaca config error could be sent.", client_address)
         return
     # ----------------------------------------
 
+    active_connections.add(state)
     try:
         # --- Main Message Loop ---
         while True:
-            data = await websocket.receive_json() # Wait for messages *after* greeting
-            print(f"[{client_address}] Received WS message: {data}")
-
-            action = data.get("action")
+            message = await websocket.receive() # Wait for messages *after* greeting
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+            # JSON may arrive as a text or a binary frame; orjson parses either without a decode
+            raw = message.get("text")
+            if raw is None:
+                raw = message.get("bytes") or b""
+            try:
+                data = orjson.loads(raw)
+            except orjson.JSONDecodeError as e:
+                await send_message(websocket, {"type": "error", "message": f"Invalid JSON message: {e}"})
+                continue
+            if not isinstance(data, dict):
+                await websocket.send_text(ERR_NOT_AN_OBJECT)
+                continue
+            if logger.isEnabledFor(logging.DEBUG): # Skip formatting the payload unless it will be logged
+                logger.debug("[%s] Received WS message: %s", client_address, data)
 
-            # Check for username in the message and update global state
+            # Check for username in the message and update the connection state
             # This allows the client to set/update the name with any action
             client_user_name = data.get("user_name")
             if client_user_name and isinstance(client_user_name, str):
-                current_user_name = client_user_name.strip()
-                print(f"[{client_address}] Updated username to: '{current_user_name}'")
+                state.user_name = client_user_name.strip()
+                logger.debug("[%s] Updated username to: '%s'", client_address, state.user_name)
 
             if not alpaca_instance:
-                await websocket.send_json({"type": "error", "message": "Alpaca assistant not initialized.", "state": "Error"})
+                await websocket.send_text(ERR_NOT_INITIALIZED)
                 continue
 
             # --- Action Handling ---
-            if action == "start":
-                mode = data.get("mode", "voice")
-                print(f"Received 'start' action, mode: {mode}")
-
-                if current_interaction_task and not current_interaction_task.done():
-                     await websocket.send_json({"type": "error", "message": "An interaction is already in progress.", "state": "Busy"})
-                     continue
-
-                if mode == "voice":
-                    # --- Start Voice Interaction ---
-                    try:
-                        interaction_queue = Queue()
-
-                        # Start the task to read from the queue and send to websocket
-                        queue_reader_task = asyncio.create_task(
-                            handle_interaction_queue(websocket, interaction_queue),
-                            name=f"QueueReader_{client_address}"
-                        )
-
-                        # Fetch interaction parameters (optional, use defaults or pass via WS)
-                        timeout = alpaca_instance.timeout_arg if hasattr(alpaca_instance, 'timeout_arg') else 10
-                        phrase_limit = alpaca_instance.phrase_limit_arg if hasattr(alpaca_instance, 'phrase_limit_arg') else 10
-                        duration = alpaca_instance.duration_arg if hasattr(alpaca_instance, 'duration_arg') else None
-                        
-                        print(f"Starting voice interaction task (timeout={timeout}, phrase_limit={phrase_limit}, duration={duration})...")
-                        # Start the actual interaction task, passing the queue and current username
-                        current_interaction_task = asyncio.create_task(
-                            alpaca_instance.interaction_handler.run_voice_interaction_loop(
-                                status_queue=interaction_queue,
-                                duration=duration,
-                                timeout=timeout,
-                                phrase_limit=phrase_limit,
-                                user_name=current_user_name # Pass current name
-                            ),
-                            name=f"VoiceInteractionLoop_{client_address}"
-                        )
-
-                        # Optional: Monitor the interaction task completion/failure
-                        # You could add a callback or await it here, but that blocks receive loop.
-                        # The handle_interaction_queue task will exit based on final status messages.
-                        # Consider adding logic to handle task exceptions if needed.
-
-                    except AttributeError as ae:
-                         print(f"Error accessing alpaca instance attributes for voice start: {ae}")
-                         traceback.print_exc()
-                         await websocket.send_json({"type": "error", "message": f"Server configuration error: {ae}", "state": "Error"})
-                         # Clean up queue/tasks if partially created
-                         if queue_reader_task and not queue_reader_task.done(): queue_reader_task.cancel()
-                         if interaction_queue: interaction_queue = None
-                         queue_reader_task = None
-                         current_interaction_task = None
-                    except Exception as e:
-                         print(f"Error starting voice interaction: {e}")
-                         traceback.print_exc()
-                         await websocket.send_json({"type": "error", "message": f"Failed to start interaction: {e}", "state": "Error"})
-                         if queue_reader_task and not queue_reader_task.done(): queue_reader_task.cancel()
-                         if interaction_queue: interaction_queue = None
-                         queue_reader_task = None
-                         current_interaction_task = None
-                    # --- End Start Voice Interaction ---
-
-                elif mode == "text":
-                     # This assumes text interaction is short and doesn't need complex task management
-                     # Re-using existing text logic here
-                     text = data.get("text", "") # Allow text with start action? Or require send_text? Let's assume require send_text.
-                     await websocket.send_json({"type": "info", "message": "Use 'send_text' action for text interactions."})
-                     # If you want start to trigger a text loop, implement similar task logic as voice
-                else:
-                     await websocket.send_json({"type": "error", "message": f"Unsupported start mode: {mode}", "state": "Error"})
-
-
-            elif action == "stop":
-                print("Received 'stop' action")
-                interrupted_by_client = False
-                if current_interaction_task and not current_interaction_task.done():
-                    print("Cancelling interaction task due to 'stop' command.")
-                    current_interaction_task.cancel()
-                    # Wait briefly for cancellation to propagate if needed, though not strictly necessary
-                    # await asyncio.sleep(0.01)
-                    interrupted_by_client = True
-                else:
-                     print("No active interaction task to stop.")
-                
-                # Queue reader task should exit automatically when it receives the final
-                # status ('Cancelled' or 'Interrupted') from the queue after the main task cancels,
-                # or on WebSocketDisconnect.
-                # We don't need to explicitly cancel queue_reader_task here unless it gets stuck.
-
-                # Reset global task/queue variables after cancellation attempt
-                current_interaction_task = None
-                queue_reader_task = None # Let it finish naturally
-                interaction_queue = None # Clear queue reference
-
-                # Send status based on whether we cancelled something
-                if interrupted_by_client:
-                    # The interaction task will put 'Cancelled' or 'Interrupted' on the queue,
-                    # which handle_interaction_queue will send.
-                    # Sending an immediate status might be redundant or confusing.
-                    # Let's just confirm the stop was processed.
-                    await websocket.send_json({"type": "info", "message": "Stop command processed. Interaction cancelled."})
-                    # Optional: Send Idle state if confident cancellation worked immediately
-                    # await websocket.send_json({"type": "status", "state": "Idle", "message": "Stopped by client."}) 
-                else:
-                     await websocket.send_json({"type": "status", "state": "Idle", "message": "Stop command received, nothing active to stop."})
-
-
-            elif action == "send_text":
-                text = data.get("text")
-                if not text:
-                    await websocket.send_json({"type": "error", "message": "Received empty text for 'send_text' action.", "state": "Idle"})
-                    continue
-
-                print(f"Received 'send_text': '{text[:50]}...'" + (f" (User: {current_user_name})" if current_user_name else ""))
-                
-                if current_interaction_task and not current_interaction_task.done():
-                    await websocket.send_json({"type": "error", "message": "Cannot send text while voice interaction is active.", "state": "Busy"})
-                    continue
-
-                await websocket.send_json({"type": "status", "state": "Processing"})
-                try:
-                    if not hasattr(alpaca_instance, 'interaction_handler'):
-                        raise AttributeError("Alpaca instance lacks an 'interaction_handler'")
-                    # Pass current username to the text interaction handler
-                    response_generator = await alpaca_instance.interaction_handler.run_single_text_interaction(
-                        user_text=text, 
-                        user_name=current_user_name
-                    )
-                    full_response = ""
-                    for chunk in response_generator:
-                        if chunk:
-                            full_response += chunk
-                            await websocket.send_json({"type": "llm_chunk", "text": chunk})
-                        await asyncio.sleep(0)
-                    await websocket.send_json({"type": "status", "state": "Idle", "final_response": full_response})
-                    print("Text interaction streaming complete.")
-                except AttributeError as ae:
-                     print(f"Error accessing interaction handler: {ae}")
-                     traceback.print_exc()
-                     await websocket.send_json({"type": "error", "message": f"Server configuration error: {ae}", "state": "Error"})
-                except Exception as e:
-                    print(f"Error during text interaction: {e}")
-                    traceback.print_exc()
-                    await websocket.send_json({"type": "error", "message": f"Error processing text: {e}", "state": "Error"})
-                    await websocket.send_json({"type": "status", "state": "Idle"})
-
-
-            elif action == "interrupt":
-                print("Received 'interrupt' action")
-                interrupted_tts = False
-                # Check if alpaca and handlers exist
-                if alpaca_instance and hasattr(alpaca_instance, 'output_handler'):
-                    output_handler = alpaca_instance.output_handler
-                    if hasattr(output_handler, 'interrupt') and callable(output_handler.interrupt):
-                        try:
-                            print("Calling output_handler.interrupt()...")
-                            output_handler.interrupt() # Call the new method
-                            interrupted_tts = True
-                        except Exception as e:
-                            print(f"Error calling output_handler.interrupt(): {e}")
-                    else:
-                        print("Warning: Output handler does not have an interrupt() method.")
-                else:
-                    print("Warning: Cannot interrupt TTS, Alpaca instance or Output handler missing.")
-
-                # Send confirmation back to client
-                if interrupted_tts:
-                    # The actual status change (Interrupted, Idle) will come via the queue later
-                    await websocket.send_json({"type": "info", "message": "Interrupt signal sent to TTS handler."})
-                else:
-                    await websocket.send_json({"type": "info", "message": "Interrupt received, but TTS handler could not be signalled."})
-
-
-            elif action == "toggle_vad_interrupt":
-                # TODO: Implement actual VAD toggle logic
-                # This requires state management and potentially modifying OutputHandler/AudioHandler
-                enabled = data.get("enabled", False)
-                print(f"Received 'toggle_vad_interrupt', enabled: {enabled} (Logic not fully implemented)")
-                # Example: Store state per connection if managing multiple clients
-                # connection_state['vad_enabled'] = enabled
-                await websocket.send_json({"type": "info", "message": f"VAD Interrupt Toggled: {enabled} (Server logic TBD)"})
-
-            else:
-                print(f"Unknown action received: {action}")
-                await websocket.send_json({"type": "error", "message": f"Unknown action: {action}"})
+            handler = ACTION_HANDLERS.get(data.get("action"), handle_unknown_action)
+            await handler(websocket, data, state)
             # --- End Action Handling ---
 
     except WebSocketDisconnect:
-        print(f"WebSocket disconnected from {client_address}.")
+        logger.info("WebSocket disconnected from %s.", client_address)
         # Clean up tasks associated with this connection
-        if current_interaction_task and not current_interaction_task.done():
-            print("Cancelling interaction task due to disconnect.")
-            current_interaction_task.cancel()
-        if queue_reader_task and not queue_reader_task.done():
-            print("Cancelling queue reader task due to disconnect.")
-            queue_reader_task.cancel()
-        current_interaction_task = None
-        queue_reader_task = None
-        interaction_queue = None
+        state.cancel_tasks()
 
     except Exception as e:
-        print(f"Error in WebSocket handler for {client_address}: {e}")
-        traceback.print_exc()
+        logger.exception("Error in WebSocket handler for %s: %s", client_address, e)
         try:
-            await websocket.send_json({"type": "error", "message": f"Server error: {e}", "state": "Error"})
+            await send_message(websocket, {"type": "error", "message": f"Server error: {e}", "state": "Error"})
             await websocket.close(code=1011)
         except Exception:
             pass # Ignore if sending/closing fails
     finally:
         # Ensure cleanup if connection closes unexpectedly
-        if current_interaction_task and not current_interaction_task.done(): current_interaction_task.cancel()
-        if queue_reader_task and not queue_reader_task.done(): queue_reader_task.cancel()
-        current_interaction_task = None
-        queue_reader_task = None
-        interaction_queue = None
-        print(f"WebSocket cleanup complete for {client_address}.")
+        state.cancel_tasks()
+        active_connections.discard(state)
+        logger.info("WebSocket cleanup complete for %s.", client_address)
 
 # --- Optional: Add entry point for running with uvicorn ---
 if __name__ == "__main__":
     import uvicorn
-    print("Starting server with uvicorn...")
+    logger.info("Starting server with uvicorn...")
     # Remember to set PYTHONPATH=. or similar if running directly
     # Or run using: uvicorn src.api.server:app --reload --port 8000 --log-level debug
     # Note: Uvicorn might need host='127.0.0.1' instead of '0.0.0.0' on some systems for localhost tests
@@ -512,4 +895,28 @@ if __name__ == "__main__":
     # uvicorn.run("server:app", ...) should be uvicorn.run(__name__ + ":app", ...) or adjust depending on execution context
     # Let's make it runnable directly assuming file is run from project root with PYTHONPATH set
     # Or more robustly: uvicorn src.api.server:app --host 127.0.0.1 --port 8000 --reload --log-level info
-    uvicorn.run(app, host="127.0.0.1", port=8000, log_level="info") # Removed reload for direct run 
\ No newline at end of file
+    #   (add --loop uvloop --http httptools --ws websockets for the same fast stack as below)
+
+    # Prefer uvloop (libuv event loop) and httptools when installed (not available on Windows);
+    # otherwise fall back to the stdlib asyncio loop and the pure-Python h11 parser.
+    import importlib.util
+    loop_impl = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http_impl = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    logger.info("Using loop=%s, http=%s, ws=websockets", loop_impl, http_impl)
+    uvicorn.run(
+        app,
+        host="127.0.0.1",
+        port=8000,
+        log_level="info",
+        loop=loop_impl,
+        http=http_impl,
+        ws="websockets",
+        # Per-connection WebSocket buffers: client frames are small JSON control messages,
+        # so cap incoming frames at 256 KB and buffer at most 16 of them. Compression is
+        # off since most outbound bytes are base64 audio, which barely deflates.
+        ws_max_size=262144,
+        ws_max_queue=16,
+        ws_ping_interval=20,
+        ws_ping_timeout=20,
+        ws_per_message_deflate=False,
+    ) # Removed reload for direct run 
\ No newline at end of file
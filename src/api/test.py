@@ -1,171 +1,559 @@
 import asyncio
+import concurrent.futures
+import functools
+import logging
+import os
+import socket
+import struct
+import threading
+import urllib.parse
 import websockets
-import json
-import base64
-import numpy as np
+import orjson
+import binascii
 import sounddevice as sd
-import traceback
 
-async def test_interaction(mode="text", text_to_send=None):
+try:
+    # SIMD base64 decoder; same call signature as the stdlib one
+    from pybase64 import b64decode
+except ImportError:
+    from base64 import b64decode
+
+logger = logging.getLogger(__name__)
+
+# Kernel receive buffer for the client socket; absorbs bursts of audio frames
+SOCKET_RCVBUF = 1 << 20
+
+# Binary audio frames (requested with "audio_transport": "binary"): 4-byte format magic,
+# little-endian uint32 sample rate, then raw PCM. Must match the server's AUDIO_FRAME_*.
+AUDIO_FRAME_HEADER = struct.Struct("<4sI")
+AUDIO_FRAME_DTYPES = {b"S16L": 'int16', b"F32L": 'float32'}
+
+# Control messages go out as binary frames holding the orjson bytes, skipping a str round trip
+INTERRUPT_FRAME = orjson.dumps({"action": "interrupt"})
+# One start frame per audio transport: "binary" gets raw PCM frames, "json" the server's
+# default base64 audio_chunk messages (exercising the decode offload and text fast path)
+START_VOICE_FRAMES = {
+    transport: orjson.dumps({"action": "start", "mode": "voice", "audio_transport": transport})
+    for transport in ("binary", "json")
+}
+
+# base64 audio longer than this is decoded on a worker thread, so the event loop can keep
+# reading frames meanwhile (pybase64 releases the GIL while decoding). Shorter payloads
+# are cheaper to decode inline than to hand off.
+OFFLOAD_DECODE_CHARS = 4096
+
+# A lone audio_chunk text frame is mostly base64; once its format and rate are known, the
+# payload is sliced out after the "data" key instead of parsing the whole frame. Every
+# AUDIO_FAST_PATH_CHECK_EVERY-th frame is still fully parsed, to pick up format or rate
+# changes and catch malformed frames.
+AUDIO_CHUNK_PREFIX = '{"type":"audio_chunk"'
+AUDIO_DATA_KEY = '"data":"'
+AUDIO_FAST_PATH_CHECK_EVERY = 50
+
+# Small chunks are coalesced on the event loop and handed to the player in submissions of
+# at least AUDIO_SUBMIT_SECONDS of audio; a remainder is flushed AUDIO_SUBMIT_DELAY after
+# it starts waiting, so a short final chunk is not held back.
+AUDIO_SUBMIT_SECONDS = 0.02
+AUDIO_SUBMIT_DELAY = 0.005
+SAMPLE_BYTES = {'int16': 2, 'float32': 4}
+
+class AudioStreamPlayer:
+    """Plays PCM audio through one persistent PortAudio output stream.
+
+    The receive loop only copies decoded bytes into a preallocated ring; the PortAudio
+    callback thread pulls them as the device needs them and pads with silence on underflow,
+    so network reception is never blocked behind playback and the device is not restarted
+    per chunk. Both sides copy through memoryview slices, so nothing is reallocated per chunk.
+    The capacity is a power of two so indices wrap with a mask; 1 MiB is ~32 s of 16 kHz int16.
+    """
+
+    def __init__(self, capacity=1 << 20, blocksize=1024, latency='low'):
+        if capacity <= 0 or capacity & (capacity - 1):
+            raise ValueError(f"capacity must be a power of two, got {capacity}")
+        self.blocksize = blocksize
+        self.latency = latency
+        self.sample_rate = None
+        self.dtype = None
+        self._stream = None
+        self._ring = bytearray(capacity)
+        self._view = memoryview(self._ring)
+        self._capacity = capacity
+        self._mask = capacity - 1
+        self._head = 0 # Next byte the callback reads
+        self._tail = 0 # Next byte the receive loop writes
+        self._size = 0 # Bytes currently buffered
+        self._lock = threading.Lock()
+
+    def _callback(self, outdata, frames, time_info, status):
+        n = len(outdata)
+        with self._lock:
+            available = min(n, self._size)
+            first = min(available, self._capacity - self._head)
+            outdata[:first] = self._view[self._head:self._head + first]
+            if available > first: # Wrapped around the end of the ring
+                outdata[first:available] = self._view[:available - first]
+            self._head = (self._head + available) & self._mask
+            self._size -= available
+        if available < n:
+            outdata[available:] = bytes(n - available) # Underflow: play silence
+
+    def open(self, sample_rate, dtype):
+        """Opens the stream on first use; reopens only if the audio format changes.
+
+        Audio still buffered in the old format is dropped on a reopen, since the new stream
+        would play it at the wrong rate or sample type.
+        """
+        if self._stream is not None:
+            if (sample_rate, dtype) == (self.sample_rate, self.dtype):
+                return
+            logger.info("Audio format changed to %s @ %s Hz, reopening output stream.", dtype, sample_rate)
+            self.close()
+            dropped = self.pending_bytes()
+            self.clear()
+            if dropped:
+                logger.warning("Dropped %d bytes of audio buffered in the previous format.", dropped)
+        self.sample_rate, self.dtype = sample_rate, dtype
+        self._stream = sd.RawOutputStream(
+            samplerate=sample_rate,
+            channels=1,
+            dtype=dtype,
+            blocksize=self.blocksize,
+            latency=self.latency,
+            callback=self._callback,
+        )
+        self._stream.start()
+
+    def write(self, audio_bytes):
+        """Copies into the ring; if it is full, the oldest unplayed bytes are dropped."""
+        with memoryview(audio_bytes) as src: # Released on return, so a bytearray can be reused
+            self._write(src)
+
+    def _write(self, src):
+        dropped = max(0, len(src) - self._capacity)
+        if dropped: # Larger than the whole ring: only its newest bytes can fit
+            src = src[dropped:]
+        n = len(src)
+        with self._lock:
+            overflow = n - (self._capacity - self._size)
+            if overflow > 0: # Make room by skipping the oldest audio
+                self._head = (self._head + overflow) & self._mask
+                self._size -= overflow
+                dropped += overflow
+            first = min(n, self._capacity - self._tail)
+            self._view[self._tail:self._tail + first] = src[:first]
+            if n > first: # Wrap around to the start of the ring
+                self._view[:n - first] = src[first:]
+            self._tail = (self._tail + n) & self._mask
+            self._size += n
+        if dropped:
+            logger.warning("Playback buffer full, dropped %d oldest audio bytes.", dropped)
+
+    def pending_bytes(self):
+        with self._lock:
+            return self._size
+
+    def clear(self):
+        """Drops buffered audio (e.g. on interrupt); the stream keeps running."""
+        with self._lock:
+            self._head = self._tail = self._size = 0
+
+    async def drain(self):
+        """Waits until everything buffered has been handed to the device."""
+        while self._stream is not None and self.pending_bytes():
+            await asyncio.sleep(0.02)
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.stop() # Plays out what the device already has, then stops
+            self._stream.close()
+            self._stream = None
+
+FINAL_STATES = ("Idle", "Error", "Cancelled", "Disabled")
+
+class InteractionSession:
+    """Receives one interaction's messages over an open connection and plays its audio.
+
+    reader_loop() only parses frames and dispatches on the message type through a dict.
+    An interrupt swaps in handlers that drop audio, so the loop never polls a flag.
+    Outgoing frames are queued and sent by writer_loop().
+    """
+
+    def __init__(self, websocket, player, interrupt_after=None):
+        self.websocket = websocket
+        self.player = player
+        self.interrupt_after = interrupt_after # Send an interrupt after this many frames (None: never)
+        self.outq = asyncio.Queue()
+        self.interrupted = asyncio.Event()
+        self.sample_rate = 16000 # Default sample rate, update if received
+        self.errors = 0 # Frames that could not be processed, reported when the session ends
+        self.dtype = 'int16'
+        # (format, rate) exactly as last received; the stream settings are only re-derived
+        # when it changes, which in practice happens once per session
+        self.stream_key = None
+        self.fast_audio_ok = False # Settings came from an audio_chunk, so the fast path may reuse them
+        # A single worker runs offloaded decodes in submission order; results are handed back
+        # to the event loop in that order, so all player writes happen on the loop thread
+        self.loop = asyncio.get_running_loop()
+        self.decoder = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="b64decode")
+        self.last_decode = None # Future of the most recently offloaded decode
+        self.decodes_pending = 0 # Offloaded decodes whose audio has not been submitted yet
+        self.audio_generation = 0 # Bumped on interrupt, so queued decodes are discarded
+        self.pending_audio = bytearray() # Coalesced audio not yet handed to the player
+        self.min_submit = 0 # Bytes in AUDIO_SUBMIT_SECONDS at the current format
+        self.flush_timer = None
+        self.on_audio_frame = self.handle_audio_frame
+        self.on_audio_text = self.handle_audio_text
+        self.handlers = {
+            "audio_chunk": self.handle_audio_chunk,
+            "status": self.handle_status,
+        }
+        self.fallback = self.handle_other
+
+    async def reader_loop(self):
+        """Dispatches incoming frames; returns the final state, or None if the connection closed."""
+        # Bound once; these are looked up on every frame otherwise
+        loads = orjson.loads
+        interrupt_after = self.interrupt_after
+        message_count = 0
+        async for response in self.websocket:
+            message_count += 1
+            # --- Send Interrupt after a few messages (for testing) ---
+            if message_count == interrupt_after:
+                logger.info("--- Sending INTERRUPT (message count: %d) ---", message_count)
+                self.outq.put_nowait(INTERRUPT_FRAME)
+            # ----------------------------------------------------------
+
+            try:
+                # Binary frames carry raw PCM audio, no JSON or base64
+                if isinstance(response, bytes):
+                    self.on_audio_frame(response)
+                    continue
+
+                if logger.isEnabledFor(logging.DEBUG): # Only copy the preview when it will be logged
+                    logger.debug("< Received raw (%dB): %s...", len(response), response[:100])
+                if (self.fast_audio_ok and message_count % AUDIO_FAST_PATH_CHECK_EVERY
+                        and response.startswith(AUDIO_CHUNK_PREFIX) and self.on_audio_text(response)):
+                    continue
+                frame = loads(response)
+                # The server sends several queued messages in one frame as a batch.
+                # Every server message has a "type", so index it directly.
+                items = frame["items"] if frame["type"] == "batch" else (frame,)
+                for data in items:
+                    # Read per item: interrupt() may swap the table midway through a batch
+                    final_state = self.handlers.get(data["type"], self.fallback)(data)
+                    if final_state:
+                        return final_state
+            except orjson.JSONDecodeError:
+                self.errors += 1
+                logger.warning("< Received non-JSON message (%dB)", len(response))
+                logger.debug("< Non-JSON payload: %s...", response[:100])
+            except Exception as e:
+                self.errors += 1
+                # Formatting a traceback per bad frame is costly during an error burst
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.exception("< Error processing received message: %s", e)
+                else:
+                    logger.error("< Error processing received message: %s", e)
+        return None
+
+    async def writer_loop(self):
+        """Sends queued frames (e.g. the interrupt) until cancelled."""
+        while True:
+            payload = await self.outq.get()
+            await self.websocket.send(payload)
+
+    def interrupt(self):
+        """Drops buffered audio and switches to handlers that ignore everything but the end."""
+        self.interrupted.set()
+        self.audio_generation += 1
+        self.cancel_flush()
+        self.pending_audio.clear()
+        self.player.clear() # Drop buffered audio immediately
+        self.on_audio_frame = self.ignore
+        self.on_audio_text = self.discard
+        self.handlers = {"status": self.handle_status_after_interrupt}
+        self.fallback = self.ignore
+
+    def configure_stream(self, key, sample_rate, dtype):
+        """Opens the player for a new format/rate; returns False if that failed."""
+        self.fast_audio_ok = False
+        if (sample_rate, dtype) == (self.player.sample_rate, self.player.dtype):
+            self.flush_audio() # Same stream settings (e.g. binary vs JSON naming); keep the audio
+        else:
+            # The player reopens and drops its buffer; audio coalesced or still being decoded
+            # in the old format must not land in the new stream either
+            self.cancel_flush()
+            if self.pending_audio:
+                logger.warning("Dropped %d bytes of coalesced audio in the previous format.", len(self.pending_audio))
+                self.pending_audio.clear()
+            self.audio_generation += 1
+        try:
+            self.player.open(sample_rate, dtype)
+        except Exception as play_e:
+            logger.exception("Error opening audio output: %s", play_e)
+            self.stream_key = None
+            return False
+        self.stream_key = key
+        self.sample_rate, self.dtype = sample_rate, dtype
+        self.min_submit = int(sample_rate * SAMPLE_BYTES[dtype] * AUDIO_SUBMIT_SECONDS)
+        return True
+
+    def handle_audio_frame(self, response):
+        if len(response) < AUDIO_FRAME_HEADER.size:
+            self.errors += 1
+            logger.warning("< Binary frame too short for an audio header (%dB), ignoring.", len(response))
+            return
+        magic, sample_rate = AUDIO_FRAME_HEADER.unpack_from(response)
+        if (magic, sample_rate) != self.stream_key:
+            dtype = AUDIO_FRAME_DTYPES.get(magic)
+            if dtype is None:
+                self.errors += 1
+                logger.warning("< Unknown binary frame %r, ignoring.", magic)
+                return
+            if not self.configure_stream((magic, sample_rate), sample_rate, dtype):
+                return
+        self.submit_audio(memoryview(response)[AUDIO_FRAME_HEADER.size:])
+
+    def handle_audio_chunk(self, data):
+        logger.debug("< Parsed Type: audio_chunk, State: %s", data.get("state"))
+        base64_audio = data.get("data")
+        if not base64_audio:
+            return
+        received_format = data.get("format", "pcm_s16le")
+        received_rate = data.get("sample_rate") or self.sample_rate
+
+        if (received_format, received_rate) != self.stream_key:
+            # Determine sample dtype based on format
+            dtype = 'int16' # Default for pcm_s16le
+            if "f32" in received_format.lower(): # Example check for float32
+                dtype = 'float32'
+                logger.info("Audio format: %s", dtype)
+            # Add more checks if other formats are possible
+            if not self.configure_stream((received_format, received_rate), int(received_rate), dtype):
+                return
+            self.fast_audio_ok = True
+
+        self.queue_audio(base64_audio)
+
+    def handle_audio_text(self, response):
+        """Queues a lone audio_chunk frame's payload without parsing the JSON.
+
+        Returns False if the payload cannot be located, so the frame is parsed normally.
+        """
+        start = response.find(AUDIO_DATA_KEY)
+        if start < 0:
+            return False
+        start += len(AUDIO_DATA_KEY)
+        end = response.find('"', start) # base64 never contains quotes or JSON escapes
+        if end <= start:
+            return False
+        self.queue_audio(response[start:end])
+        return True
+
+    def queue_audio(self, base64_audio):
+        """Decodes a chunk inline, or on the decoder thread if it is large or one is pending."""
+        if len(base64_audio) > OFFLOAD_DECODE_CHARS or self.decodes_pending:
+            # Small chunks also queue behind a pending decode, so they are not played ahead of it
+            decode = asyncio.wrap_future(self.decoder.submit(b64decode, base64_audio, validate=False), loop=self.loop)
+            decode.add_done_callback(functools.partial(self.on_decoded, self.audio_generation))
+            self.decodes_pending += 1
+            self.last_decode = decode
+            return
+        try:
+            audio_bytes = b64decode(base64_audio, validate=False) # Accepts the str as-is
+        except binascii.Error as b64e:
+            logger.error("Error decoding base64: %s", b64e)
+            return
+        self.submit_audio(audio_bytes)
+
+    def on_decoded(self, generation, decode):
+        """Submits an offloaded decode's audio; runs on the event loop, in submission order."""
+        self.decodes_pending -= 1
+        if generation != self.audio_generation or decode.cancelled():
+            return # Interrupted (or shut down) while this chunk was queued
+        if decode.exception() is not None:
+            logger.error("Error decoding base64: %s", decode.exception())
+            return
+        self.submit_audio(decode.result())
+
+    def submit_audio(self, audio_bytes):
+        """Hands audio to the player in submissions of at least min_submit bytes."""
+        if not self.pending_audio and len(audio_bytes) >= self.min_submit:
+            self.player.write(audio_bytes) # Already large enough; skip the copy
+        else:
+            self.pending_audio += audio_bytes
+            if len(self.pending_audio) >= self.min_submit:
+                self.flush_audio()
+            elif self.flush_timer is None:
+                self.flush_timer = self.loop.call_later(AUDIO_SUBMIT_DELAY, self.flush_audio)
+        if logger.isEnabledFor(logging.DEBUG): # pending_bytes() takes the player lock
+            logger.debug("Queued %d audio bytes at %d Hz (%d bytes buffered).", len(audio_bytes), self.sample_rate, self.player.pending_bytes())
+
+    def flush_audio(self):
+        self.cancel_flush()
+        if self.pending_audio:
+            self.player.write(self.pending_audio)
+            self.pending_audio.clear()
+
+    def cancel_flush(self):
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+
+    async def finish_audio(self):
+        """Waits for offloaded decodes, then hands any coalesced remainder to the player."""
+        if self.last_decode is not None:
+            # Its done callback (which submits the audio) runs before this await resumes
+            await asyncio.gather(self.last_decode, return_exceptions=True)
+        self.flush_audio()
+
+    def close(self):
+        self.cancel_flush()
+        self.decoder.shutdown(wait=False, cancel_futures=True)
+
+    def handle_status(self, data):
+        state = data.get("state")
+        logger.debug("< Parsed Type: status, State: %s", state)
+        if "capabilities" in data:
+            # Hello sent on connect, not the end of an interaction
+            logger.info("< Server ready, capabilities: %s", data["capabilities"])
+        elif state == "Interrupted":
+            logger.info("<- INTERRUPT received! Stopping playback and ignoring further audio.")
+            self.interrupt()
+            # Don't stop yet, wait for final Idle/Error/Cancelled from QueueReader exit
+        elif state in FINAL_STATES:
+            return state
+        else:
+            logger.info("< Received JSON: %s", data) # Log other status updates
+        return None
+
+    def handle_status_after_interrupt(self, data):
+        state = data.get("state")
+        if state in FINAL_STATES or state == "Interrupted":
+            logger.info("<- Received final status after interrupt was flagged.")
+            return state
+        return None
+
+    def handle_other(self, data):
+        # Print other message types like transcripts etc.
+        logger.debug("< Parsed Type: %s, State: %s", data.get("type"), data.get("state"))
+        logger.info("< Received JSON: %s", data)
+        return None
+
+    def ignore(self, data):
+        return None
+
+    def discard(self, response):
+        return True # Handled: dropped without parsing
+
+async def open_tuned_socket(uri):
+    """Connects a TCP socket for `uri` with Nagle disabled and a larger receive buffer.
+
+    asyncio already sets TCP_NODELAY on its transports; it is set here explicitly since
+    SO_RCVBUF has to be applied before connecting to affect the TCP window.
+    """
+    parts = urllib.parse.urlsplit(uri)
+    port = parts.port or (443 if parts.scheme == "wss" else 80)
+    loop = asyncio.get_running_loop()
+    # Try every address in order, like asyncio.open_connection: "localhost" often resolves to
+    # ::1 first while the server only listens on 127.0.0.1
+    last_error = None
+    for family, type_, proto, _, address in await loop.getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM):
+        sock = socket.socket(family, type_, proto)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_RCVBUF)
+            sock.setblocking(False)
+            await loop.sock_connect(sock, address)
+        except OSError as e:
+            sock.close()
+            last_error = e
+            continue
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+    raise last_error
+
+async def test_interaction(mode="text", text_to_send=None, audio_transport="binary"):
     uri = "ws://localhost:8000/ws" # Make sure the port matches your uvicorn command
-    audio_buffer = [] # Buffer to store incoming audio chunks
-    sample_rate = 16000 # Default sample rate, update if received
-    audio_format = 'int16' # Default format based on pcm_s16le
-    playback_interrupted = False # Flag to stop playback on interrupt
+    player = AudioStreamPlayer() # Opened lazily on the first audio chunk
 
-    print(f"--- Testing {mode.upper()} mode ---")
+    logger.info("--- Testing %s mode ---", mode.upper())
     if mode == "text" and not text_to_send:
         text_to_send = "Hello from the test script! Tell me about Alpacas."
 
     try:
-        async with websockets.connect(uri) as websocket:
-            print(f"Connected to {uri}")
+        # No permessage-deflate: PCM (raw or base64) barely compresses, so inflating every
+        # frame is wasted CPU. No size cap for large audio frames, and no cap on queued frames:
+        # the reader consumes them as they arrive, so memory is bounded by the server's send
+        # rate, and reading never pauses mid-burst. Larger write buffer for control messages.
+        sock = await open_tuned_socket(uri)
+        async with websockets.connect(uri, sock=sock, compression=None, max_size=None, max_queue=None, write_limit=1 << 20) as websocket:
+            logger.info("Connected to %s", uri)
 
             # --- Prepare Message --- 
             if mode == "voice":
-                message_to_send = {
-                    "action": "start",
-                    "mode": "voice"
-                }
+                payload = START_VOICE_FRAMES.get(audio_transport)
+                if payload is None:
+                    logger.error("Unsupported audio transport '%s'", audio_transport)
+                    return
             elif mode == "text":
-                message_to_send = {
+                payload = orjson.dumps({
                     "action": "send_text",
                     "text": text_to_send
-                }
+                })
             else:
-                print(f"Error: Unsupported test mode '{mode}'")
+                logger.error("Unsupported test mode '%s'", mode)
                 return
             # ---------------------
 
-            print(f"> Sending: {json.dumps(message_to_send)}")
-            await websocket.send(json.dumps(message_to_send))
+            logger.info("> Sending: %s", payload.decode())
+            await websocket.send(payload)
 
-            print("< Receiving messages...")
-            message_count = 0 # Counter for sending interrupt
-            interrupt_sent = False # Flag to ensure interrupt is sent only once
+            logger.info("< Receiving messages...")
+            session = InteractionSession(websocket, player, interrupt_after=3 if mode == "voice" else None)
+            reader = asyncio.create_task(session.reader_loop())
+            writer = asyncio.create_task(session.writer_loop())
             try:
-                while True:
-                    response = await websocket.recv()
-                    message_count += 1
-                    # --- Check for interrupt *before* processing --- 
-                    if playback_interrupted:
-                        print("< Ignoring message after interrupt.")
-                        # Keep receiving until connection closes or final status is re-confirmed
-                        # Or break here if desired?
-                        # Let's try processing just the final status to break cleanly
-                        try:
-                             data = json.loads(response)
-                             if data.get("type") == "status" and data.get("state") in ["Idle", "Error", "Interrupted", "Cancelled", "Disabled"]:
-                                 print("<- Received final status after interrupt was flagged. Breaking loop.")
-                                 break
-                             else:
-                                 continue # Ignore other messages after interrupt
-                        except:
-                            continue # Ignore non-json after interrupt
-                    # -------------------------------------------------
-
-                    print(f"< Received raw: {response[:100]}...") # Print truncated raw response
-
-                    try:
-                        data = json.loads(response)
-                        msg_type = data.get("type")
-                        state = data.get("state")
-                        
-                        print(f"< Parsed Type: {msg_type}, State: {state}") # Log parsed type/state
-
-                        # --- Send Interrupt after a few messages (for testing) ---
-                        if mode == "voice" and not interrupt_sent and message_count >= 3:
-                            print(f"--- Sending INTERRUPT (message count: {message_count}) ---")
-                            await websocket.send(json.dumps({"action": "interrupt"}))
-                            interrupt_sent = True
-                        # ----------------------------------------------------------
-
-                        if msg_type == "audio_chunk":
-                            # --- Check interrupt flag before playing --- 
-                            if playback_interrupted:
-                                print("    Skipping audio chunk due to prior interrupt.")
-                                continue
-                            # -----------------------------------------
-                            
-                            base64_audio = data.get("data")
-                            received_rate = data.get("sample_rate")
-                            received_format = data.get("format", "pcm_s16le").lower()
-
-                            if received_rate:
-                                sample_rate = int(received_rate)
-                            
-                            # Determine numpy dtype based on format
-                            dtype = np.int16 # Default for pcm_s16le
-                            if "f32" in received_format: # Example check for float32
-                                dtype = np.float32
-                                print(f"    (Audio format: {dtype})")
-                            # Add more checks if other formats are possible
-
-                            if base64_audio:
-                                try:
-                                    audio_bytes = base64.b64decode(base64_audio)
-                                    # Convert bytes to numpy array
-                                    audio_array = np.frombuffer(audio_bytes, dtype=dtype)
-                                    print(f"    Decoded {len(audio_bytes)} audio bytes, playing {len(audio_array)} samples at {sample_rate} Hz...")
-                                    sd.play(audio_array, samplerate=sample_rate)
-                                    # --- Wait for playback to finish before processing next message --- 
-                                    print("    Waiting for chunk playback to complete...")
-                                    sd.wait() 
-                                    print("    Playback complete.")
-                                    # --- End wait ---
-
-                                except base64.binascii.Error as b64e:
-                                     print(f"    Error decoding base64: {b64e}")
-                                except Exception as play_e:
-                                     print(f"    Error playing audio chunk: {play_e}")
-                                     traceback.print_exc()
-                        
-                        elif msg_type == "status":
-                            if state == "Interrupted":
-                                print("<- INTERRUPT received! Stopping playback and ignoring further audio.")
-                                playback_interrupted = True
-                                sd.stop() # Stop current playback immediately
-                                # Don't break yet, wait for final Idle/Error/Cancelled from QueueReader exit
-                            
-                            elif state in ["Idle", "Error", "Cancelled", "Disabled"]:
-                                print(f"<- Received final state '{state}'. Waiting for audio playback...")
-                                sd.wait() # Wait for any audio *already playing* to finish
-                                print("<- Playback finished. Closing connection.")
-                                break # Exit loop
-                            
-                            # Print other status updates
-                            else:
-                                print(f"< Received JSON: {data}") 
-
-                        # Print other message types like transcripts etc.
-                        elif msg_type != "audio_chunk" and msg_type != "status": 
-                             print(f"< Received JSON: {data}") 
-
-                    except json.JSONDecodeError:
-                        print(f"< Received non-JSON message: {response[:100]}...")
-                    except Exception as e:
-                        print(f"< Error processing received message: {e}")
-                        traceback.print_exc()
-
-            except websockets.exceptions.ConnectionClosedOK:
-                print("< Connection closed normally.")
-                sd.wait() # Ensure audio finishes if connection closed mid-stream
-            except websockets.exceptions.ConnectionClosedError as e:
-                print(f"< Connection closed with error: {e}")
-                sd.wait()
+                try:
+                    final_state = await reader
+                    if final_state:
+                        logger.info("<- Received final state '%s'. Waiting for audio playback...", final_state)
+                    else:
+                        logger.info("< Connection closed normally.")
+                except websockets.exceptions.ConnectionClosedError as e:
+                    logger.error("< Connection closed with error: %s", e)
+                if session.errors:
+                    logger.warning("< %d received frame(s) could not be processed.", session.errors)
+                if not session.interrupted.is_set(): # Interrupted audio was already dropped
+                    await session.finish_audio()
+                    await player.drain() # Wait for any audio *already received* to play
+                logger.info("<- Playback finished. Closing connection.")
+            finally:
+                writer.cancel()
+                await asyncio.gather(writer, return_exceptions=True)
+                session.close()
 
     except ConnectionRefusedError:
-        print(f"Error: Connection refused. Is the server running at {uri}?")
+        logger.error("Connection refused. Is the server running at %s?", uri)
     except Exception as e:
-        print(f"An error occurred: {e}")
-        traceback.print_exc()
+        logger.exception("An error occurred: %s", e)
     finally:
-        print("Stopping any lingering audio playback...")
-        sd.stop()
+        logger.info("Stopping any lingering audio playback...")
+        player.close()
 
 if __name__ == "__main__":
     # Ensure the server is running before executing this script
     # Run the FastAPI server: uvicorn src.api.server:app --reload --port 8000
-    print("--- Make sure the FastAPI server is running! ---")
+    # Per-frame details are logged at DEBUG; run with LOG_LEVEL=DEBUG to see them.
+    # AUDIO_TRANSPORT=json requests base64 audio in JSON instead of binary PCM frames.
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    logger.info("--- Make sure the FastAPI server is running! ---")
+    try:
+        import uvloop # libuv event loop, cheaper per await on the receive path
+        uvloop.install()
+    except ImportError:
+        pass # Not available (e.g. on Windows); the default asyncio loop works too
     # asyncio.run(test_interaction(mode="text"))
-    asyncio.run(test_interaction(mode="voice"))
+    asyncio.run(test_interaction(mode="voice", audio_transport=os.getenv("AUDIO_TRANSPORT", "binary")))